@@ -16,11 +16,12 @@
 
 """Create, parse and apply "context" format diffs"""
 
-import collections
 import difflib
 import os
 import re
 
+from dataclasses import dataclass
+
 from . import t_diff
 from . import diffstat
 from . import pd_utils
@@ -30,52 +31,120 @@ __author__ = "Peter Williams <pwil3058@gmail.com>"
 
 DEBUG = False
 
-# Useful named tuples to make code clearer
-_CHUNK = collections.namedtuple("_CHUNK", ["start", "length"])
-_HUNK = collections.namedtuple("_HUNK", ["offset", "start", "length", "numlines"])
+@dataclass(frozen=True, slots=True)
+class _CHUNK:
+    start: int
+    length: int
+
+
+@dataclass(frozen=True, slots=True)
+class _HUNK:
+    offset: int
+    start: int
+    length: int
+    numlines: int
 
 
 class ContextDiffHunk(t_diff.TextDiffHunk):
     """Class to encapsulate a single context diff hunk
     """
     LEN_LINE_PREFIX = 2
-    def _process_tws(self, fix=False):
+    def _process_tws(self, fix=False, out=None):
         """If "fix" is True remove any trailing white space from
         changed lines and return a list of lines that were fixed
         otherwise return a list of changed lines that have tailing
-        white space
+        white space.  If "out" is provided append to it instead of
+        allocating a fresh list.
         """
-        bad_lines = list()
+        bad_lines = out if out is not None else list()
+        lines = self.lines
         for index in range(self.after.offset + 1, self.after.offset + self.after.numlines):
-            if self.lines[index].startswith("+ ") or self.lines[index].startswith("! "):
-                repl_line = self.lines[index][:2] + t_diff.trim_trailing_ws(self.lines[index][2:])
+            line = lines[index]
+            leadin = line[:2]
+            if leadin == "+ " or leadin == "! ":
+                repl_line = leadin + t_diff.trim_trailing_ws(line[2:])
                 after_count = index - (self.after.offset + 1)
-                if len(repl_line) != len(self.lines[index]):
+                if len(repl_line) != len(line):
                     bad_lines.append(str(self.after.start + after_count))
                     if fix:
-                        self.lines[index] = repl_line
-            elif DEBUG and not self.lines[index].startswith("  "):
+                        lines[index] = repl_line
+        return bad_lines
+
+    def _process_tws_debug(self, fix=False, out=None):
+        """Variant of "_process_tws" that validates the hunk's lines
+        as it goes.  Installed in its place when DEBUG is set.
+        """
+        bad_lines = out if out is not None else list()
+        lines = self.lines
+        for index in range(self.after.offset + 1, self.after.offset + self.after.numlines):
+            line = lines[index]
+            leadin = line[:2]
+            if leadin == "+ " or leadin == "! ":
+                repl_line = leadin + t_diff.trim_trailing_ws(line[2:])
+                after_count = index - (self.after.offset + 1)
+                if len(repl_line) != len(line):
+                    bad_lines.append(str(self.after.start + after_count))
+                    if fix:
+                        lines[index] = repl_line
+            elif leadin != "  ":
                 raise t_diff.Bug("Unexpected end of context diff hunk.")
         return bad_lines
 
-    def get_diffstat_stats(self):
-        """Return the "diffstat" statistics for this chunk
+    def analyze(self, fix=False):
+        """Return this chunk's "diffstat" statistics along with the
+        list of changed lines that have (or, if "fix" is True, had)
+        trailing white space, sharing the "after" component traversal
+        between the two jobs
         """
         stats = diffstat.DiffStats()
+        bad_lines = list()
+        lines = self.lines
         for index in range(self.before.offset + 1, self.before.offset + self.before.numlines):
-            if self.lines[index].startswith("- "):
+            leadin = lines[index][:2]
+            if leadin == "- ":
                 stats.incr("deleted")
-            elif self.lines[index].startswith("! "):
+            elif leadin == "! ":
                 stats.incr("modified")
-            elif DEBUG and not self.lines[index].startswith("  "):
-                raise t_diff.Bug("Unexpected end of context diff \"before\" hunk.")
         for index in range(self.after.offset + 1, self.after.offset + self.after.numlines):
-            if self.lines[index].startswith("+ "):
-                stats.incr("inserted")
-            elif self.lines[index].startswith("! "):
-                stats.incr("modified")
-            elif DEBUG and not self.lines[index].startswith("  "):
-                raise t_diff.Bug("Unexpected end of context diff \"after\" hunk.")
+            line = lines[index]
+            leadin = line[:2]
+            if leadin == "+ " or leadin == "! ":
+                stats.incr("inserted" if leadin == "+ " else "modified")
+                repl_line = leadin + t_diff.trim_trailing_ws(line[2:])
+                if len(repl_line) != len(line):
+                    bad_lines.append(str(self.after.start + index - (self.after.offset + 1)))
+                    if fix:
+                        lines[index] = repl_line
+        return (stats, bad_lines)
+
+    def _get_diffstat_stats(self):
+        """Compute the "diffstat" statistics for this chunk
+        """
+        # the section markers are distinguishable by their first
+        # character alone so join the first characters of each section
+        # into compact strings and let str.count() do the scanning
+        lines = self.lines
+        before_firsts = "".join(line[:1] for line in lines[self.before.offset + 1:self.before.offset + self.before.numlines])
+        after_firsts = "".join(line[:1] for line in lines[self.after.offset + 1:self.after.offset + self.after.numlines])
+        stats = diffstat.DiffStats()
+        stats.incr("deleted", before_firsts.count("-"))
+        stats.incr("inserted", after_firsts.count("+"))
+        stats.incr("modified", before_firsts.count("!") + after_firsts.count("!"))
+        return stats
+
+    def _get_diffstat_stats_debug(self):
+        """Variant of "_get_diffstat_stats" that validates the hunk's
+        lines as it goes.  Installed in its place when DEBUG is set.
+        """
+        lines = self.lines
+        before_firsts = "".join(line[:1] for line in lines[self.before.offset + 1:self.before.offset + self.before.numlines])
+        after_firsts = "".join(line[:1] for line in lines[self.after.offset + 1:self.after.offset + self.after.numlines])
+        if before_firsts.strip("-! ") or after_firsts.strip("+! "):
+            raise t_diff.Bug("Unexpected end of context diff hunk.")
+        stats = diffstat.DiffStats()
+        stats.incr("deleted", before_firsts.count("-"))
+        stats.incr("inserted", after_firsts.count("+"))
+        stats.incr("modified", before_firsts.count("!") + after_firsts.count("!"))
         return stats
 
     def iter_before_lines(self):
@@ -98,15 +167,27 @@ class ContextDiffHunk(t_diff.TextDiffHunk):
         return (line for line in self._iter_lines(self.lines[start:end]))
 
 
+if DEBUG:
+    # install the validating variants of the hot loop methods so that
+    # the fast versions carry no per line DEBUG tests at all
+    ContextDiffHunk._process_tws = ContextDiffHunk._process_tws_debug
+    ContextDiffHunk._get_diffstat_stats = ContextDiffHunk._get_diffstat_stats_debug
+
+
 class ContextDiffParser(t_diff.TextDiffParser):
     """Class to parse "context" diffs
     """
     diff_format = "context"
-    BEFORE_FILE_CRE = re.compile(r"^\*\*\* ({0})(\s+{1})?$".format(pd_utils.PATH_RE_STR, t_diff.EITHER_TS_RE_STR))
-    AFTER_FILE_CRE = re.compile(r"^--- ({0})(\s+{1})?$".format(pd_utils.PATH_RE_STR, t_diff.EITHER_TS_RE_STR))
-    HUNK_START_CRE = re.compile(r"^\*{15}\s*(.*)$")
-    HUNK_BEFORE_CRE = re.compile(r"^\*\*\*\s+(\d+)(,(\d+))?\s+\*\*\*\*\s*(.*)$")
-    HUNK_AFTER_CRE = re.compile(r"^---\s+(\d+)(,(\d+))?\s+----(.*)$")
+    BEFORE_FILE_CRE = re.compile(r"\*\*\* ({0})(\s+{1})?$".format(pd_utils.PATH_RE_STR, t_diff.EITHER_TS_RE_STR))
+    AFTER_FILE_CRE = re.compile(r"--- ({0})(\s+{1})?$".format(pd_utils.PATH_RE_STR, t_diff.EITHER_TS_RE_STR))
+    _BEFORE_FILE_MATCH = BEFORE_FILE_CRE.match
+    _AFTER_FILE_MATCH = AFTER_FILE_CRE.match
+    HUNK_START_CRE = re.compile(r"\*{15}\s*(.*)$")
+    HUNK_BEFORE_CRE = re.compile(r"\*\*\*\s+(\d+)(,(\d+))?\s+\*\*\*\*\s*(.*)$")
+    HUNK_AFTER_CRE = re.compile(r"---\s+(\d+)(,(\d+))?\s+----(.*)$")
+    _HUNK_START_MATCH = HUNK_START_CRE.match
+    _HUNK_BEFORE_MATCH = HUNK_BEFORE_CRE.match
+    _HUNK_AFTER_MATCH = HUNK_AFTER_CRE.match
 
     @staticmethod
     def _chunk(match):
@@ -122,7 +203,9 @@ class ContextDiffParser(t_diff.TextDiffParser):
     def _get_before_chunk_at(lines, index):
         """Extract the context diff "before" chunk from "lines" starting
         at "index"."""
-        match = ContextDiffParser.HUNK_BEFORE_CRE.match(lines[index])
+        if not lines[index].startswith("***"):
+            return (None, index)
+        match = ContextDiffParser._HUNK_BEFORE_MATCH(lines[index])
         if not match:
             return (None, index)
         return (ContextDiffParser._chunk(match), index + 1)
@@ -131,14 +214,19 @@ class ContextDiffParser(t_diff.TextDiffParser):
     def _get_after_chunk_at(lines, index):
         """Extract the context diff "after" chunk from "lines" starting
         at "index"."""
-        match = ContextDiffParser.HUNK_AFTER_CRE.match(lines[index])
+        if not lines[index].startswith("---"):
+            return (None, index)
+        match = ContextDiffParser._HUNK_AFTER_MATCH(lines[index])
         if not match:
             return (None, index)
         return (ContextDiffParser._chunk(match), index + 1)
 
     @staticmethod
     def get_hunk_at(lines, index):
-        if not ContextDiffParser.HUNK_START_CRE.match(lines[index]):
+        # cheap one-comparison reject before starting the regex engine
+        if not lines[index].startswith("*"):
+            return (None, index)
+        if not ContextDiffParser._HUNK_START_MATCH(lines[index]):
             return (None, index)
         start_index = index
         before_start_index = index + 1
@@ -164,7 +252,7 @@ class ContextDiffParser(t_diff.TextDiffParser):
                 if after_chunk is None:
                     raise t_diff.ParseError(_("Failed to find context diff \"after\" hunk."), index)
             while after_count < after_chunk.length:
-                if not lines[index].startswith(("! ", "+ ", "  ")):
+                if lines[index][:2] not in ("! ", "+ ", "  "):
                     if after_count == 0:
                         break
                     raise t_diff.ParseError(_("Unexpected end of context diff hunk."), index)
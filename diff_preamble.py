@@ -42,6 +42,7 @@ class ParseError(Exception):
 class _Preamble(TextLines):
     """Generic diff preamble
     """
+    __slots__ = ("file_data", "extras")
     preamble_type_id = None
 
     @classmethod
@@ -115,6 +116,7 @@ class _Preamble(TextLines):
 class GitPreamble(_Preamble):
     """Encapsulation of "git" diff preamble used in patches
     """
+    __slots__ = ()
     preamble_type_id = "git"
     DIFF_CRE = re.compile(r"^diff\s+--git\s+({0})\s+({1})$".format(PATH_RE_STR, PATH_RE_STR))
     EXTRAS_CRES = {
@@ -130,6 +132,18 @@ class GitPreamble(_Preamble):
         "dissimilarity index": re.compile(r"^(dissimilarity index)\s+((\d*)%)$"),
         "index": re.compile(r"^(index)\s+(([a-fA-F0-9]+)..([a-fA-F0-9]+)( (\d*))?)$"),
     }
+    # the line's first word narrows the candidates to at most two
+    # patterns so a dict lookup replaces trying all eleven per line
+    _EXTRAS_MATCH_DISPATCH = {
+        "old": (EXTRAS_CRES["old mode"].match,),
+        "new": (EXTRAS_CRES["new mode"].match, EXTRAS_CRES["new file mode"].match),
+        "deleted": (EXTRAS_CRES["deleted file mode"].match,),
+        "copy": (EXTRAS_CRES["copy from"].match, EXTRAS_CRES["copy to"].match),
+        "rename": (EXTRAS_CRES["rename from"].match, EXTRAS_CRES["rename to"].match),
+        "similarity": (EXTRAS_CRES["similarity index"].match,),
+        "dissimilarity": (EXTRAS_CRES["dissimilarity index"].match,),
+        "index": (EXTRAS_CRES["index"].match,),
+    }
 
     @classmethod
     def get_preamble_at(cls, lines, index, raise_if_malformed):
@@ -137,17 +151,26 @@ class GitPreamble(_Preamble):
         Return a GitPreamble and the index of the first line after the
         preamble if found else return None and the index unchanged.
         """
-        match = cls.DIFF_CRE.match(lines[index])
+        line = lines[index]
+        # cheap literal prefix reject before starting the regex engine
+        if not line.startswith("diff"):
+            return (None, index)
+        match = cls.DIFF_CRE.match(line)
         if not match:
             return (None, index)
         file1 = match.group(3) if match.group(3) else match.group(4)
         file2 = match.group(6) if match.group(6) else match.group(7)
         extras = {}
         next_index = index + 1
-        while next_index < len(lines):
+        num_lines = len(lines)
+        while next_index < num_lines:
             found = False
-            for cre in cls.EXTRAS_CRES:
-                match = cls.EXTRAS_CRES[cre].match(lines[next_index])
+            line = lines[next_index]
+            candidates = cls._EXTRAS_MATCH_DISPATCH.get(line.partition(" ")[0])
+            if candidates is None:
+                break
+            for extras_match in candidates:
+                match = extras_match(line)
                 if match:
                     extras[match.group(1)] = match.group(2)
                     next_index += 1
@@ -228,6 +251,7 @@ class GitPreamble(_Preamble):
 class DiffPreamble(_Preamble):
     """Encapsulate the simple "diff" style diff preamble
     """
+    __slots__ = ()
     preamble_type_id = "diff"
     CRE = re.compile(r"^diff(\s.+)\s+({0})\s+({1})$".format(PATH_RE_STR, PATH_RE_STR))
 
@@ -237,7 +261,11 @@ class DiffPreamble(_Preamble):
         Return a DiffPreamble and the index of the first line after the
         preamble if found else return None and the index unchanged.
         """
-        match = cls.CRE.match(lines[index])
+        line = lines[index]
+        # cheap literal prefix reject before starting the regex engine
+        if not line.startswith("diff"):
+            return (None, index)
+        match = cls.CRE.match(line)
         if not match or (match.group(1) and match.group(1).find("--git") != -1):
             return (None, index)
         file1 = match.group(3) if match.group(3) else match.group(4)
@@ -262,6 +290,7 @@ class DiffPreamble(_Preamble):
 class IndexPreamble(_Preamble):
     """Encapsulate the simple "Index" style diff preamble
     """
+    __slots__ = ()
     preamble_type_id = "index"
     FILE_RCE = re.compile(r"^Index:\s+({0})(.*)$".format(PATH_RE_STR))
     SEP_RCE = re.compile(r"^==*$")
@@ -272,7 +301,11 @@ class IndexPreamble(_Preamble):
         Return a IndexPreamble and the index of the first line after the
         preamble if found else return None and the index unchanged.
         """
-        match = cls.FILE_RCE.match(lines[index])
+        line = lines[index]
+        # cheap literal prefix reject before starting the regex engine
+        if not line.startswith("Index:"):
+            return (None, index)
+        match = cls.FILE_RCE.match(line)
         if not match:
             return (None, index)
         filepath = match.group(2) if match.group(2) else match.group(3)
@@ -356,11 +389,22 @@ class Preambles(collections.OrderedDict):
 DIFF_PREAMBLE_TYPES = [GitPreamble, DiffPreamble, IndexPreamble]
 DIFF_PREAMBLE_TYPE_IDS = [dpt.preamble_type_id for dpt in DIFF_PREAMBLE_TYPES]
 
+# a preamble's opening line starts with either "diff" (git or plain)
+# or "Index:" so its first character picks the candidate subtypes
+# without trying the other types' regexes
+_PREAMBLE_TYPE_DISPATCH = {
+    "d": (GitPreamble, DiffPreamble),
+    "I": (IndexPreamble,),
+}
+
 
 def get_preamble_at(lines, index, raise_if_malformed, exclude_subtypes_in=None):
     """Parse "lines" starting at "index" looking for a preamble
     """
-    for subtype in DIFF_PREAMBLE_TYPES:
+    candidates = _PREAMBLE_TYPE_DISPATCH.get(lines[index][:1])
+    if candidates is None:
+        return (None, index)
+    for subtype in candidates:
         if exclude_subtypes_in and subtype in exclude_subtypes_in:
             continue
         preamble, next_index = subtype.get_preamble_at(lines, index, raise_if_malformed)
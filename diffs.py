@@ -35,13 +35,23 @@ class ParseError(Exception):
         self.lineno = lineno
 
 
+# each format's first line starts with a distinctive three character
+# prefix so the right parser can be picked without running the other
+# formats' detection logic
+_DIFF_TYPE_DISPATCH = {
+    "---": unified_diff,
+    "GIT": git_binary_diff,
+    "***": context_diff,
+}
+
+
 def get_diff_at(lines, index, raise_if_malformed):
     """If there is a valid unified, context or git binary diff in
     "lines" starting at "index" extract and return it along with the
     index for the first line after the diff.
     """
-    # NB. these are ordered by likelihood of being encountered (these days)
-    for diff_type in [unified_diff, git_binary_diff, context_diff]:
+    diff_type = _DIFF_TYPE_DISPATCH.get(lines[index][:3]) if index < len(lines) else None
+    if diff_type is not None:
         diff, next_index = diff_type.get_diff_at(lines, index, raise_if_malformed)
         if diff is not None:
             return (diff, next_index)
@@ -21,6 +21,7 @@ __all__ = []
 __author__ = "Peter Williams <pwil3058@gmail.com>"
 
 import collections
+import math
 import os
 import re
 
@@ -33,19 +34,29 @@ class ErrorMalformedDiffStatSummary(Exception):
 
 def get_common_path(filelist):
     """Return the longest common path componet for the files in the list"""
-    # Extra wrapper required because os.path.commonprefix() is string oriented
-    # rather than file path oriented (which is strange)
-    return os.path.dirname(os.path.commonprefix(filelist))
+    # os.path.commonpath() works on whole path components so (unlike
+    # the old string oriented commonprefix() approach) it gets the
+    # answer in one pass with no dirname() clean up afterwards
+    if not filelist:
+        return ""
+    try:
+        common_path = os.path.commonpath(filelist)
+    except ValueError:
+        return ""
+    if common_path == filelist[0]:
+        # all the paths are identical: report their directory
+        common_path = os.path.dirname(common_path)
+    return common_path
 
 
-EMPTY_CRE = re.compile("^#? 0 files changed$")
-END_CRE = re.compile(r"^#? (\d+) files? changed" +
+EMPTY_CRE = re.compile("#? 0 files changed$")
+END_CRE = re.compile(r"#? (\d+) files? changed" +
                      r"(, (\d+) insertions?\(\+\))?" +
                      r"(, (\d+) deletions?\(-\))?" +
                      r"(, (\d+) modifications?\(\!\))?$")
-FSTATS_CRE = re.compile(r"^#? (\S+)\s*\|((binary)|(\s*(\d+)(\s+\+*-*\!*)?))$")
-BLANK_LINE_CRE = re.compile(r"^\s*$")
-DIVIDER_LINE_CRE = re.compile(r"^---$")
+FSTATS_CRE = re.compile(r"#? (\S+)\s*\|((binary)|(\s*(\d+)(\s+\+*-*\!*)?))$")
+BLANK_LINE_CRE = re.compile(r"\s*$")
+DIVIDER_LINE_CRE = re.compile(r"---$")
 
 
 def get_summary_length_starting_at(lines, index):
@@ -53,20 +64,26 @@ def get_summary_length_starting_at(lines, index):
     given list of lines return the number of lines it contains or else
     return 0
     """
+    # bind the bound match method to a local: the loops below run once
+    # per line and the attribute lookups add up
+    fstats_match = FSTATS_CRE.match
+    num_lines = len(lines)
     start = index
     if DIVIDER_LINE_CRE.match(lines[index]):
         index += 1
-    while index < len(lines) and BLANK_LINE_CRE.match(lines[index]):
+    # blankness doesn't need the regex engine: str.strip is dispatched
+    # straight to C
+    while index < num_lines and not lines[index].strip():
         index += 1
-    if index >= len(lines):
+    if index >= num_lines:
         return 0
     if EMPTY_CRE.match(lines[index]):
         return index - start
     count = 0
-    while index < len(lines) and FSTATS_CRE.match(lines[index]):
+    while index < num_lines and fstats_match(lines[index]):
         count += 1
         index += 1
-    if index < len(lines) and END_CRE.match(lines[index]):
+    if index < num_lines and END_CRE.match(lines[index]):
         return index - start
     elif count == 0:
         return 0
@@ -81,10 +98,9 @@ def list_summary_starts_at(lines, index):
 def format_diffstat_list(diff_stats_list, quiet=False, trim_names=False, comment=False, max_width=80):
     """Return a formatted string for the list of statistics
     """
-    import math
     if len(diff_stats_list) == 0 and quiet:
         return ""
-    string = ""
+    parts = []
     if trim_names:
         common_path = get_common_path([x.path for x in diff_stats_list])
         offset = len(common_path)
@@ -93,10 +109,24 @@ def format_diffstat_list(diff_stats_list, quiet=False, trim_names=False, comment
     num_files = len(diff_stats_list)
     summation = DiffStats()
     if num_files > 0:
-        len_longest_name = max([len(x.path) for x in diff_stats_list]) - offset
-        largest_total = max(max([x.diff_stats.get_total() for x in diff_stats_list]), 1)
+        # gather names, totals, the field widths and the summation in
+        # one pass; only the formatting (which needs the widths) has
+        # to wait for a second one
+        rows = []
+        len_longest_name = 0
+        largest_total = 1
+        for x in diff_stats_list:
+            name = x.path[offset:]
+            diff_stats = x.diff_stats
+            total = diff_stats.get_total()
+            summation += diff_stats
+            if len(name) > len_longest_name:
+                len_longest_name = len(name)
+            if total > largest_total:
+                largest_total = total
+            rows.append((name, diff_stats, total))
         sig_digits = int(math.log10(largest_total)) + 1
-        fstr = "%s {0}{1} | {2:%s} {3}\n" % ("#" if comment else "", sig_digits)
+        fstr = "%s {0} | {1:%s} {2}\n" % ("#" if comment else "", sig_digits)
         avail_width = max(0, max_width - (len_longest_name + 4 + sig_digits))
         if comment:
             avail_width -= 1
@@ -104,75 +134,82 @@ def format_diffstat_list(diff_stats_list, quiet=False, trim_names=False, comment
         def scale(count):
             """Scale the count to fit on a line"""
             return min((count * avail_width) // largest_total, count)
-        for stats in diff_stats_list:
-            summation += stats.diff_stats
-            total = stats.diff_stats.get_total()
-            name = stats.path[offset:]
-            spaces = " " * (len_longest_name - len(name))
-            bar = stats.diff_stats.as_bar(scale)
-            string += fstr.format(name, spaces, total, bar)
+        for name, diff_stats, total in rows:
+            parts.append(fstr.format(name.ljust(len_longest_name), total, diff_stats.as_bar(scale)))
     if num_files > 0 or not quiet:
         if comment:
-            string += "#"
-        string += " {0} file{1} changed".format(num_files, "" if num_files == 1 else "s")
-        string += summation.as_string()
-        string += "\n"
-    return string
+            parts.append("#")
+        parts.append(" {0} file{1} changed".format(num_files, "" if num_files == 1 else "s"))
+        parts.append(summation.as_string())
+        parts.append("\n")
+    return "".join(parts)
 
 
 class DiffStats:
     """Class to hold one set diffstat statistics."""
+    # the counts live in fixed slots rather than a dict: aggregation
+    # and increments then cost an attribute add with no hashing and
+    # each instance is roughly half the size
+    __slots__ = ("inserted", "deleted", "modified", "unchanged")
     _ORDERED_KEYS = ["inserted", "deleted", "modified", "unchanged"]
-    _FMT_DATA = {
-        "inserted": "{0} insertion{1}(+)",
-        "deleted": "{0} deletion{1}(-)",
-        "modified": "{0} modification{1}(!)",
-        "unchanged": "{0} unchanged line{1}(+)"
-    }
 
     def __init__(self):
-        self._counts = {}
-        for key in self._ORDERED_KEYS:
-            self._counts[key] = 0
-        assert len(self._counts) == len(self._ORDERED_KEYS)
+        self.inserted = 0
+        self.deleted = 0
+        self.modified = 0
+        self.unchanged = 0
 
     def __iadd__(self, other):
-        for key in self._ORDERED_KEYS:
-            self._counts[key] += other[key]
+        self.inserted += other.inserted
+        self.deleted += other.deleted
+        self.modified += other.modified
+        self.unchanged += other.unchanged
         return self
 
     def __len__(self):
-        return len(self._counts)
+        return len(self._ORDERED_KEYS)
 
     def __getitem__(self, key):
         if isinstance(key, int):
             key = self._ORDERED_KEYS[key]
-        return self._counts[key]
+        return getattr(self, key)
 
     def get_total(self):
         """Get total lines
         """
-        return sum(list(self))
+        return self.inserted + self.deleted + self.modified + self.unchanged
 
     def get_total_changes(self):
         """Get total changed lines
         """
-        return sum([self._counts[key] for key in self._ORDERED_KEYS[:-1]])
+        return self.inserted + self.deleted + self.modified
 
-    def incr(self, key):
+    def incr(self, key, count=1):
         """Increment the count for the given "key"
         """
-        self._counts[key] += 1
-        return self._counts[key]
+        count += getattr(self, key)
+        setattr(self, key, count)
+        return count
 
     def as_string(self, joiner=", ", prefix=", "):
         """Format the statistics as a string
         """
+        # unrolled with f-strings: str.format re-parses its format
+        # specification on every call and this runs once per row of
+        # format_diffstat_list
         strings = []
-        for key in self._ORDERED_KEYS:
-            num = self._counts[key]
-            if num:
-                strings.append(self._FMT_DATA[key].format(num, "" if num == 1 else "s"))
+        num = self.inserted
+        if num:
+            strings.append(f"{num} insertion{'' if num == 1 else 's'}(+)")
+        num = self.deleted
+        if num:
+            strings.append(f"{num} deletion{'' if num == 1 else 's'}(-)")
+        num = self.modified
+        if num:
+            strings.append(f"{num} modification{'' if num == 1 else 's'}(!)")
+        num = self.unchanged
+        if num:
+            strings.append(f"{num} unchanged line{'' if num == 1 else 's'}(+)")
         if strings:
             return prefix + joiner.join(strings)
         else:
@@ -181,12 +218,12 @@ class DiffStats:
     def as_bar(self, scale=lambda x: x):
         """Format the statistics as a bar
         """
-        string = ""
-        for key in self._ORDERED_KEYS:
-            count = scale(self._counts[key])
-            char = self._FMT_DATA[key][-2]
-            string += char * count
-        return string
+        # a single join assembles the bar without the intermediate
+        # strings that chained concatenation would build
+        return "".join(("+" * scale(self.inserted),
+                        "-" * scale(self.deleted),
+                        "!" * scale(self.modified),
+                        "+" * scale(self.unchanged)))
 
 class PathDiffStats(collections.namedtuple("PathDiffStats", ["path", "diff_stats"])):
     """Named tuple to hold a file path and associated "diffstat" stats
@@ -17,7 +17,7 @@
 """Create, parse and apply "git" binary diffs"""
 
 import collections
-import re
+import itertools
 import sys
 import zlib
 
@@ -43,19 +43,32 @@ class DataError(Exception):
 class ZippedData:
     """Class to encapsulate zipped data
     """
+    __slots__ = ("raw_len", "zipped_data", "_raw")
     ZLIB_COMPRESSION_LEVEL = 6
+    _EMPTY_ZIPPED = zlib.compress(b"", ZLIB_COMPRESSION_LEVEL)
 
     def __init__(self, data):
-        if data is not None:
+        if data is None:
+            self._raw = None
+            self.raw_len = None
+            self.zipped_data = None
+        elif not data:
+            # empty payloads (file creation/deletion) always compress
+            # to the same short stream so skip the deflate set up
+            self._raw = b""
+            self.raw_len = 0
+            self.zipped_data = self._EMPTY_ZIPPED
+        else:
             try:
+                # retain the raw bytes: every current consumer reads
+                # them straight back so a decompression round trip
+                # would be pure waste
+                self._raw = bytes(data)
                 self.raw_len = len(data)
-                self.zipped_data = zlib.compress(bytes(data), self.ZLIB_COMPRESSION_LEVEL)
+                self.zipped_data = zlib.compress(self._raw, self.ZLIB_COMPRESSION_LEVEL)
             except TypeError as edata:
                 print("ZIP:", len(data), ":", data, "|")
                 raise edata
-        else:
-            self.raw_len = None
-            self.zipped_data = None
 
     def __bool__(self):
         return self.zipped_data is not None
@@ -64,7 +77,9 @@ class ZippedData:
     def raw_data(self):
         """The unzipped version of the encapsulated zipped data
         """
-        return zlib.decompress(self.zipped_data)
+        if self._raw is None:
+            self._raw = zlib.decompress(self.zipped_data)
+        return self._raw
 
     @property
     def zipped_len(self):
@@ -82,7 +97,10 @@ class GitBinaryDiffData(pd_utils.TextLines):
         pd_utils.TextLines.__init__(self, lines)
         self.method = method
         self.size_raw = size_raw
-        self.data_zipped = data_zipped
+        # normalize to immutable bytes up front so repeat "data_raw"
+        # reads don't re-copy the buffer
+        self.data_zipped = bytes(data_zipped)
+        self._data_raw = None
 
     @property
     def size_zipped(self):
@@ -94,7 +112,9 @@ class GitBinaryDiffData(pd_utils.TextLines):
     def data_raw(self):
         """Non compressed version of the data.
         """
-        return zlib.decompress(bytes(self.data_zipped))
+        if self._data_raw is None:
+            self._data_raw = zlib.decompress(self.data_zipped)
+        return self._data_raw
 
 class GitBinaryDiff(collections.namedtuple("GitBinaryDiff", ["lines", "forward", "reverse"])):
     """Class to encapsulate a git binary diff
@@ -187,57 +207,66 @@ class GitBinaryDiff(collections.namedtuple("GitBinaryDiff", ["lines", "forward",
         return retval
 
 
-START_CRE = re.compile(r"^GIT binary patch$")
-DATA_START_CRE = re.compile(r"^(literal|delta) (\d+)$")
-BLANK_LINE_CRE = re.compile(r"^\s*$")
-
-
-def get_data_at(lines, start_index):
+def get_data_at(lines, start_index, validate_size=True):
     """If there is a valid git binary diff data in "lines" starting
     at "index" extract and return it along with the index for the
-    first line after the data.
+    first line after the data.  Callers that trust the input (e.g.
+    round trips through our own generator) can pass "validate_size"
+    False to skip the decompression that backs the size check.
     """
-    smatch = False if start_index >= len(lines) else DATA_START_CRE.match(lines[start_index])
-    if not smatch:
+    # the start line's shape is simple enough for string methods:
+    # "literal <size>" or "delta <size>"
+    if start_index >= len(lines):
+        return (None, start_index)
+    method, sep, size_str = lines[start_index].partition(" ")
+    if not sep or method not in ("literal", "delta"):
+        return (None, start_index)
+    size_str = size_str.rstrip("\n")
+    if not size_str.isdigit():
         return (None, start_index)
-    method = smatch.group(1)
-    size = int(smatch.group(2))
+    size = int(size_str)
     index = start_index + 1
     while index < len(lines) and gitbase85.LINE_CRE.match(lines[index]):
         index += 1
     end_data = index
     # absorb the blank line if there is one
-    if BLANK_LINE_CRE.match(lines[index]):
+    if not lines[index].strip():
         index += 1
     dlines = lines[start_index:index]
     try:
-        data_zipped = gitbase85.decode_lines(lines[start_index + 1:end_data])
+        data_zipped = gitbase85.decode_lines(itertools.islice(lines, start_index + 1, end_data))
     except AssertionError:
         raise DataError(_("Inconsistent git binary patch data."), lineno=start_index)
-    raw_size = len(zlib.decompress(bytes(data_zipped)))
-    if raw_size != size:
-        emsg = _("Git binary patch expected {0} bytes. Got {1} bytes.").format(size, raw_size)
-        raise DataError(emsg, lineno=start_index)
-    return (GitBinaryDiffData(dlines, method, raw_size, data_zipped), index)
-
-
-def get_diff_at(lines, start_index, raise_if_malformed=True):
+    data = GitBinaryDiffData(dlines, method, size, data_zipped)
+    if validate_size:
+        # zlib accepts any buffer so the bytearray from decode_lines
+        # can be decompressed without an intermediate bytes copy
+        raw_data = zlib.decompress(data_zipped)
+        if len(raw_data) != size:
+            emsg = _("Git binary patch expected {0} bytes. Got {1} bytes.").format(size, len(raw_data))
+            raise DataError(emsg, lineno=start_index)
+        # validation already paid for the decompression so keep the result
+        data._data_raw = raw_data
+    return (data, index)
+
+
+def get_diff_at(lines, start_index, raise_if_malformed=True, validate_size=True):
     """If there is a valid git binary diff in "lines" starting at
     "index" extract and return it along with the index for the
     first line after the diff.
     """
-    if not START_CRE.match(lines[start_index]):
+    if lines[start_index] not in ("GIT binary patch\n", "GIT binary patch"):
         return (None, start_index)
-    forward, index = get_data_at(lines, start_index + 1)
+    forward, index = get_data_at(lines, start_index + 1, validate_size=validate_size)
     if forward is None and raise_if_malformed:
         raise ParseError(_("No content in GIT binary patch text."))
-    reverse, index = get_data_at(lines, index)
+    reverse, index = get_data_at(lines, index, validate_size=validate_size)
     return (GitBinaryDiff(lines[start_index:index], forward, reverse), index)
 
 
-def parse_diff_lines(lines):
+def parse_diff_lines(lines, validate_size=True):
     """Parse list of lines and return a valid "unified" diff or raise exception"""
-    diff, index = get_diff_at(lines, 0, raise_if_malformed=True)
+    diff, index = get_diff_at(lines, 0, raise_if_malformed=True, validate_size=validate_size)
     if not diff or index < len(lines):
         raise ParseError(_("Not a valid \"unified\" diff."), index)
     return diff
@@ -248,31 +277,57 @@ def parse_diff_text(text):
     return parse_diff_lines(text.splitlines(True))
 
 
+def _component_data(fm_data, to_data):
+    """Build the GitBinaryDiffData for one direction of a diff between
+    the given zipped before and after data.
+    """
+    delta = None
+    if fm_data.raw_len and to_data.raw_len:
+        delta = ZippedData(gitdelta.diff_delta(fm_data.raw_data, to_data.raw_data))
+    if delta and delta.zipped_len < to_data.zipped_len:
+        method, source = (GitBinaryDiffData.DELTA, delta)
+    else:
+        method, source = (GitBinaryDiffData.LITERAL, to_data)
+    lines = ["{0} {1}\n".format(method, source.raw_len)] + gitbase85.encode_to_lines(source.zipped_data) + ["\n"]
+    data = GitBinaryDiffData(lines, method, source.raw_len, source.zipped_data)
+    data._data_raw = source.raw_data
+    return data
+
+
+def _generate_diff_components(before, after):
+    """Generate the forward and reverse data components of a git
+    binary diff between the provided before and after data or None if
+    they are equal.
+    """
+    # callers regenerating a diff often hand us the same buffer for
+    # both sides so try the O(1) identity test before the full compare
+    if before.content is after.content or before.content == after.content:
+        return None
+    orig = ZippedData(before.content)
+    darned = ZippedData(after.content)
+    return (_component_data(orig, darned), _component_data(darned, orig))
+
+
 def generate_diff_lines(before, after):
     """Generate the text lines of a git binary diff from the provided
     before and after data.
     """
-
-    def _component_lines(fm_data, to_data):
-        delta = None
-        if fm_data.raw_len and to_data.raw_len:
-            delta = ZippedData(gitdelta.diff_delta(fm_data.raw_data, to_data.raw_data))
-        if delta and delta.zipped_len < to_data.zipped_len:
-            lines = ["delta {0}\n".format(delta.raw_len)] + gitbase85.encode_to_lines(delta.zipped_data) + ["\n"]
-        else:
-            lines = ["literal {0}\n".format(to_data.raw_len)] + gitbase85.encode_to_lines(to_data.zipped_data) + ["\n"]
-        return lines
-
-    if before.content == after.content:
+    components = _generate_diff_components(before, after)
+    if components is None:
         return []
-    orig = ZippedData(before.content)
-    darned = ZippedData(after.content)
-    return ["GIT binary patch\n"] + _component_lines(orig, darned) + _component_lines(darned, orig)
+    forward, reverse = components
+    return ["GIT binary patch\n"] + forward.lines + reverse.lines
 
 
 def generate_diff(before, after):
     """Generate the git binary diff from the provided
     before and after data.
     """
-    diff_lines = generate_diff_lines(before, after)
-    return parse_diff_lines(diff_lines) if diff_lines else None
+    # everything a GitBinaryDiff needs is already in hand so build it
+    # directly rather than reparsing the lines we just emitted
+    components = _generate_diff_components(before, after)
+    if components is None:
+        return None
+    forward, reverse = components
+    lines = ["GIT binary patch\n"] + forward.lines + reverse.lines
+    return GitBinaryDiff(lines, forward, reverse)
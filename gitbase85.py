@@ -118,10 +118,12 @@ def decode_line(line):
     return decode(Encoding(line[1:].rstrip(), decode_size(line[0])))
 
 def decode_lines(lines):
-    data = bytes()
+    # accumulate in a mutable buffer: repeated bytes concatenation
+    # copies everything decoded so far on every line
+    data = bytearray()
     for line in lines:
         data += decode_line(line)
-    return data
+    return bytes(data)
 
 LINE_CRE = re.compile("^([a-zA-Z])(([0-9a-zA-Z" + re.sub("-", "", str(ENCODE[62:])) + "-]{5})+)$")
 
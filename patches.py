@@ -16,42 +16,85 @@
 """Classes and functions for operations on patch files"""
 
 import collections
-import re
+import concurrent.futures
+import itertools
 import os
 import email
 import zlib
 import hashlib
 
+from dataclasses import dataclass
+
 from . import gitbase85
 from . import diffstat
 from . import diff_preamble
 from . import diffs
+from . import pd_utils
 
 from .pd_utils import TextLines
 from .pd_utils import FilePathPlus
 
 # TODO: convert methods that return lists to iterators
 
-# Useful named tuples to make code clearer
-_FILE_AND_TWS_LINES = collections.namedtuple("_FILE_AND_TWS_LINES", ["path", "tws_lines"])
+
+@dataclass(frozen=True, slots=True)
+class _FILE_AND_TWS_LINES:
+    path: str
+    tws_lines: list
+
+
+# a diff plus can only open with a preamble ("diff ...", "Index:...")
+# or a diff ("--- ...", "*** ...", "GIT binary patch") so anything else
+# can be rejected with one prefix test instead of a full parse attempt
+_DIFF_PLUS_LEADINS = ("diff", "Index:", "---", "***", "GIT")
+
+
+# defined once here: namedtuple() execs generated source so building
+# the type inside check_relevance() cost a class construction per call
+_RELEVANCE = collections.namedtuple("_RELEVANCE", ["goodness", "missing", "unexpected"])
 
 
 DEBUG = False
 
+# per file work is independent so for patches touching a lot of files
+# it is worth farming it out to a thread pool; files are coarser units
+# than hunks so the threshold is lower than t_diff's
+_PARALLEL_DIFF_PLUS_THRESHOLD = 16
+
+
+def _map_over_diff_pluses(function, diff_pluses):
+    """Apply "function" to each of "diff_pluses" (in order) using a
+    thread pool when there are enough of them to cover the pool's
+    overheads
+    """
+    if len(diff_pluses) > _PARALLEL_DIFF_PLUS_THRESHOLD:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            return list(executor.map(function, diff_pluses))
+    return [function(diff_plus) for diff_plus in diff_pluses]
+
 
 class Header:
+    # fixed slots: a big patch collection creates a lot of these and
+    # the per instance dict is pure overhead
+    __slots__ = ("comment_lines", "description_lines", "diffstat_lines")
+
     def __init__(self, text=""):
         lines = text.splitlines(True)
-        descr_starts_at = 0
-        for line in lines:
-            if not line.startswith("#"):
-                break
-            descr_starts_at += 1
+        # count the leading comment lines with the loop in C
+        descr_starts_at = sum(1 for line in itertools.takewhile(lambda line: line.startswith("#"), lines))
         self.comment_lines = TextLines(lines[:descr_starts_at])
         diffstat_starts_at = None
+        num_lines = len(lines)
+        summary_starts_at = diffstat.list_summary_starts_at
         index = descr_starts_at
-        while index < len(lines):
-            if diffstat.list_summary_starts_at(lines, index):
+        while index < num_lines:
+            line = lines[index]
+            # cheap prefilter: a summary can only open with a divider,
+            # a blank line, a "0 files changed" line or an fstats row
+            # (which always contains "|") so most description lines
+            # never reach the full validator
+            if ("|" in line or line.startswith("---") or "0 files changed" in line or not line.strip()) \
+                    and summary_starts_at(lines, index):
                 diffstat_starts_at = index
                 break
             index += 1
@@ -66,9 +109,7 @@ class Header:
         return self.get_comments() + self.get_description() + self.get_diffstat()
 
     def iter_lines(self):
-        for lines in [self.comment_lines, self.description_lines, self.diffstat_lines]:
-            for line in lines:
-                yield line
+        return itertools.chain(self.comment_lines, self.description_lines, self.diffstat_lines)
 
     def get_comments(self):
         return str(self.comment_lines)
@@ -80,16 +121,28 @@ class Header:
         return str(self.diffstat_lines)
 
     def set_comments(self, text):
+        # callers shuffling components around may already hold a
+        # TextLines: adopt it as is rather than rendering and
+        # re-wrapping the text
+        if isinstance(text, TextLines):
+            self.comment_lines = text
+            return
         if text and not text.endswith("\n"):
             text += "\n"
         self.comment_lines = TextLines(text)
 
     def set_description(self, text):
+        if isinstance(text, TextLines):
+            self.description_lines = text
+            return
         if text and not text.endswith("\n"):
             text += "\n"
         self.description_lines = TextLines(text)
 
     def set_diffstat(self, text):
+        if isinstance(text, TextLines):
+            self.diffstat_lines = text
+            return
         if text and not text.endswith("\n"):
             text += "\n"
         self.diffstat_lines = TextLines(text)
@@ -98,6 +151,9 @@ class Header:
 class DiffPlus:
     """Class to hold diff (headerless) information relavent to a single file.
     Includes (optional) preambles and trailing junk such as quilt's separators."""
+    # one instance per file in a patch: fixed slots keep them small
+    __slots__ = ("preambles", "diff", "trailing_junk", "_hash_cache", "_str_cache")
+
     @staticmethod
     def get_diff_plus_at(lines, start_index, raise_if_malformed=False):
         preambles, index = diff_preamble.get_preambles_at(lines, start_index, raise_if_malformed)
@@ -131,21 +187,24 @@ class DiffPlus:
         self.preambles = preambles if isinstance(preambles, diff_preamble.Preambles) else diff_preamble.Preambles.fm_list(preambles)
         self.diff = diff
         self.trailing_junk = TextLines(trailing_junk)
+        self._hash_cache = None
+        self._str_cache = None
 
     def __str__(self):
-        if self.diff is not None:
-            return str(self.preambles) + str(self.diff) + str(self.trailing_junk)
-        else:
-            return str(self.preambles) + str(self.trailing_junk)
+        # cached alongside the hash digest and invalidated at the same
+        # points: stringification is requested repeatedly by Patch and
+        # display code between mutations
+        if self._str_cache is None:
+            if self.diff is not None:
+                self._str_cache = "".join((str(self.preambles), str(self.diff), str(self.trailing_junk)))
+            else:
+                self._str_cache = str(self.preambles) + str(self.trailing_junk)
+        return self._str_cache
 
     def iter_lines(self):
-        for line in self.preambles.iter_lines():
-            yield line
         if self.diff:
-            for line in self.diff.iter_lines():
-                yield line
-        for line in self.trailing_junk:
-            yield line
+            return itertools.chain(self.preambles.iter_lines(), self.diff.iter_lines(), self.trailing_junk)
+        return itertools.chain(self.preambles.iter_lines(), self.trailing_junk)
 
     def get_preamble_for_type(self, preamble_type):
         return self.preambles.get(preamble_type, None)
@@ -170,6 +229,8 @@ class DiffPlus:
     def fix_trailing_whitespace(self):
         if self.diff is None:
             return []
+        self._hash_cache = None
+        self._str_cache = None
         return self.diff.fix_trailing_whitespace()
 
     def report_trailing_whitespace(self):
@@ -190,7 +251,11 @@ class DiffPlus:
 
     def get_file_path_plus(self, strip_level):
         from .pd_utils import DiffOutcome
-        file_path, outcome = self.diff.get_file_path_and_outcome(strip_level) if self.diff else (None, None)
+        if self.diff is not None:
+            fpp = self.diff.get_file_path_and_outcome(strip_level)
+            file_path, outcome = (fpp.path, fpp.status)
+        else:
+            file_path, outcome = (None, None)
         if not file_path:
             return self.preambles.get_file_path_plus(strip_level=strip_level)
         elif outcome == DiffOutcome.CREATED:
@@ -201,14 +266,29 @@ class DiffPlus:
             return FilePathPlus(file_path, FilePathPlus.EXTANT, None)
 
     def get_hash_digest(self):
-        h = hashlib.sha1()
-        h.update(str(self).encode())
-        return h.digest()
+        # the digest is requested repeatedly (e.g. to detect changes)
+        # so cache it; our mutating methods null the cache but callers
+        # who alter components directly are on their own
+        if self._hash_cache is None:
+            if self._str_cache is not None:
+                # the rendered text is already in hand so take
+                # hashlib's one shot constructor path
+                self._hash_cache = hashlib.sha1(self._str_cache.encode()).digest()
+            else:
+                # feed the hash line by line rather than materializing
+                # the whole text just to digest it
+                h = hashlib.sha1()
+                for line in self.iter_lines():
+                    h.update(line.encode())
+                self._hash_cache = h.digest()
+        return self._hash_cache
 
 
 class Patch:
     """Class to hold patch information relavent to multiple files with
     an optional header (or a single file with a header)."""
+    __slots__ = ("source_name", "num_strip_levels", "header", "diff_pluses", "_hash_cache", "_str_cache")
+
     @staticmethod
     def parse_lines(lines, num_strip_levels=0):
         """Parse list of lines and return a Patch instance"""
@@ -216,19 +296,34 @@ class Patch:
         diff_pluses = list()
         index = 0
         last_diff_plus = None
-        while index < len(lines):
+        junk_starts_at = None
+        num_lines = len(lines)
+        get_diff_plus_at = DiffPlus.get_diff_plus_at
+        while index < num_lines:
+            if not lines[index].startswith(_DIFF_PLUS_LEADINS):
+                # most lines are hunk bodies or junk: skip the parse
+                if last_diff_plus and junk_starts_at is None:
+                    junk_starts_at = index
+                index += 1
+                continue
             raise_if_malformed = diff_starts_at is not None
             starts_at = index
-            diff_plus, index = DiffPlus.get_diff_plus_at(lines, index, raise_if_malformed)
+            diff_plus, index = get_diff_plus_at(lines, index, raise_if_malformed)
             if diff_plus:
+                if junk_starts_at is not None:
+                    # flush the pending run of junk lines in one batch
+                    last_diff_plus.trailing_junk.append(lines[junk_starts_at:starts_at])
+                    junk_starts_at = None
                 if diff_starts_at is None:
                     diff_starts_at = starts_at
                 diff_pluses.append(diff_plus)
                 last_diff_plus = diff_plus
                 continue
-            elif last_diff_plus:
-                last_diff_plus.trailing_junk.append(lines[index])
+            elif last_diff_plus and junk_starts_at is None:
+                junk_starts_at = index
             index += 1
+        if junk_starts_at is not None:
+            last_diff_plus.trailing_junk.append(lines[junk_starts_at:])
         patch = Patch(num_strip_levels=num_strip_levels)
         patch.diff_pluses = diff_pluses
         patch.set_header("".join(lines[0:diff_starts_at]))
@@ -242,11 +337,22 @@ class Patch:
     @staticmethod
     def parse_email_text(text, num_strip_levels=0):
         """Parse email text and return a Patch instance."""
-        msg = email.message_from_string(text)
+        return Patch._parse_email_message(email.message_from_string(text), num_strip_levels)
+
+    @staticmethod
+    def parse_email_bytes(data, num_strip_levels=0):
+        """Parse email bytes and return a Patch instance."""
+        # the email package decodes the headers itself so raw bytes
+        # can be fed straight in without a separate decode pass
+        return Patch._parse_email_message(email.message_from_bytes(data), num_strip_levels)
+
+    @staticmethod
+    def _parse_email_message(msg, num_strip_levels):
         subject = msg.get("Subject")
         if subject:
             # email may have inapproriate newlines (and they play havoc with REs) so fix them
-            text = re.sub("\r\n", "\n", msg.get_payload())
+            # a literal substitution: str.replace does it without the regex engine
+            text = msg.get_payload().replace("\r\n", "\n")
         else:
             text = msg.get_payload()
         patch = Patch.parse_text(text, num_strip_levels=num_strip_levels)
@@ -255,17 +361,26 @@ class Patch:
             patch.set_description("\n".join([subject, descr]))
         return patch
 
+    @staticmethod
+    def _read_file_text(filepath):
+        # read the raw bytes in one go and decode them once: the text
+        # layer's incremental decode is redundant for a whole file read
+        # and "with" closes the descriptor even if the read fails
+        with open(filepath, "rb") as f_obj:
+            return f_obj.read().decode("utf-8", errors="replace")
+
     @staticmethod
     def parse_text_file(filepath, num_strip_levels=0):
         """Parse a text file and return a Patch instance."""
-        patch = Patch.parse_text(open(filepath).read(), num_strip_levels=num_strip_levels)
+        patch = Patch.parse_text(Patch._read_file_text(filepath), num_strip_levels=num_strip_levels)
         patch.source_name = filepath
         return patch
 
     @staticmethod
     def parse_email_file(filepath, num_strip_levels=0):
         """Parse a text file and return a Patch instance."""
-        patch = Patch.parse_email_text(open(filepath).read(), num_strip_levels=num_strip_levels)
+        with open(filepath, "rb") as f_obj:
+            patch = Patch.parse_email_bytes(f_obj.read(), num_strip_levels=num_strip_levels)
         patch.source_name = filepath
         return patch
 
@@ -274,20 +389,26 @@ class Patch:
         self.num_strip_levels = int(num_strip_levels)
         self.header = Header()
         self.diff_pluses = list()
+        self._hash_cache = None
+        self._str_cache = None
 
     def _adjusted_strip_level(self, strip_level):
-        return int(strip_level) if strip_level is not None else self.num_strip_levels
+        # num_strip_levels is coerced to int where it is set so no
+        # conversion is needed on this per lookup path
+        return strip_level if strip_level is not None else self.num_strip_levels
 
     def set_strip_level(self, strip_level):
         self.num_strip_levels = int(strip_level)
 
     def estimate_strip_level(self):
+        # git patches will always have a strip level of 1 and are the
+        # common case: settle that with a cheap membership scan before
+        # paying for any per diff consistency checks
+        if any("git" in diff_plus.preambles for diff_plus in self.diff_pluses):
+            return 1
         trues = 0
         for diff_plus in self.diff_pluses:
-            if "git" in diff_plus.preambles:
-                # git patches will always have a strip level of 1
-                return 1
-            check = _file_data_consistent_with_strip_one(diff_plus.diff.file_data)
+            check = pd_utils.file_data_consistent_with_strip_one(diff_plus.diff.header)
             if check is True:
                 trues += 1
             elif check is False:
@@ -295,30 +416,47 @@ class Patch:
         return 1 if trues > 0 else None
 
     def check_relevance(self, strip_level=None, path=None):
-        relevance = collections.namedtuple("relevance", ["goodness", "missing", "unexpected"])
         fpath = (lambda fp: fp) if path is None else lambda fp: os.path.join(path, fp)
+        num_created = 0
+        num_expected = 0
         missing = list()
         unexpected = list()
         fpluses = self.get_file_paths_plus(strip_level)
+        # patches commonly touch many files in the same directory so
+        # answer the existence questions from one listdir() per unique
+        # directory instead of a stat() per file
+        dir_contents = dict()
+
+        def file_exists(fppath):
+            dir_path, file_name = os.path.split(fppath)
+            entries = dir_contents.get(dir_path)
+            if entries is None:
+                try:
+                    entries = frozenset(os.listdir(dir_path if dir_path else "."))
+                except OSError:
+                    entries = frozenset()
+                dir_contents[dir_path] = entries
+            return file_name in entries
         for fplus in fpluses:
             fppath = fpath(fplus.path)
-            exists = os.path.exists(fppath)
             if fplus.status == FilePathPlus.ADDED:
                 num_created += 1
-                if exists:
+                if file_exists(fppath):
                     unexpected.append(fppath)
             else:
                 num_expected += 1
-                if not exists:
+                if not file_exists(fppath):
                     missing.append(fppath)
         badness = 100 if len(fpluses) == 0 else (100 * len(missing) * len(unexpected)) // len(fpluses)
-        return relevance(goodness=100-badness, missing=missing, unexpected=unexpected)
+        return _RELEVANCE(goodness=100-badness, missing=missing, unexpected=unexpected)
 
     def get_header(self):
         return self.header
 
     def set_header(self, text):
         self.header = Header(text)
+        self._hash_cache = None
+        self._str_cache = None
 
     def get_comments(self):
         return "" if self.header is None else self.header.get_comments()
@@ -328,6 +466,8 @@ class Patch:
             self.header = Header(text)
         else:
             self.header.set_comments(text)
+        self._hash_cache = None
+        self._str_cache = None
 
     def get_description(self):
         return "" if self.header is None else self.header.get_description()
@@ -337,6 +477,8 @@ class Patch:
             self.header = Header(text)
         else:
             self.header.set_description(text)
+        self._hash_cache = None
+        self._str_cache = None
 
     def get_header_diffstat(self):
         return "" if self.header is None else self.header.get_diffstat()
@@ -348,23 +490,26 @@ class Patch:
             stats = self.get_diffstat_stats(strip_level)
             text = "-\n\n%s\n" %  diffstat.format_diffstat_list(stats)
         self.header.set_diffstat(text)
+        self._hash_cache = None
+        self._str_cache = None
 
     def __str__(self):
-        string = "" if self.header is None else str(self.header)
-        for diff_plus in self.diff_pluses:
-            string += str(diff_plus)
-        return string
+        # cached alongside the hash digest and invalidated at the same
+        # points
+        if self._str_cache is None:
+            parts = [] if self.header is None else [str(self.header)]
+            parts.extend(str(diff_plus) for diff_plus in self.diff_pluses)
+            self._str_cache = "".join(parts)
+        return self._str_cache
 
     def iter_lines(self):
-        for line in self.header:
-            yield line
-        for diff_plus in self.diff_pluses:
-            for line in diff_plus:
-                yield line
+        # NB. Header and DiffPlus aren't themselves iterable: go
+        # through their iter_lines() methods
+        return itertools.chain(self.header.iter_lines(),
+                               *[diff_plus.iter_lines() for diff_plus in self.diff_pluses])
 
     def get_file_paths(self, strip_level=None):
-        strip_level = self._adjusted_strip_level(strip_level)
-        return [diff_plus.get_file_path(strip_level=strip_level) for diff_plus in self.diff_pluses]
+        return list(self.iterate_file_paths(strip_level=strip_level))
 
     def iterate_file_paths(self, strip_level=None):
         strip_level = self._adjusted_strip_level(strip_level)
@@ -372,8 +517,7 @@ class Patch:
             yield diff_plus.get_file_path(strip_level=strip_level)
 
     def get_file_paths_plus(self, strip_level=None):
-        strip_level = self._adjusted_strip_level(strip_level)
-        return [diff_plus.get_file_path_plus(strip_level=strip_level) for diff_plus in self.diff_pluses]
+        return list(self.iterate_file_paths_plus(strip_level=strip_level))
 
     def iterate_file_paths_plus(self, strip_level=None):
         strip_level = self._adjusted_strip_level(strip_level)
@@ -386,25 +530,54 @@ class Patch:
 
     def fix_trailing_whitespace(self, strip_level=None):
         strip_level = self._adjusted_strip_level(strip_level)
+        self._hash_cache = None
+        self._str_cache = None
         reports = []
-        for diff_plus in self.diff_pluses:
-            bad_lines = diff_plus.fix_trailing_whitespace()
+        all_bad_lines = _map_over_diff_pluses(lambda dp: dp.fix_trailing_whitespace(), self.diff_pluses)
+        for diff_plus, bad_lines in zip(self.diff_pluses, all_bad_lines):
             if bad_lines:
                 path = diff_plus.get_file_path(strip_level=strip_level)
                 reports.append(_FILE_AND_TWS_LINES(path, bad_lines))
         return reports
 
-    def report_trailing_whitespace(self, strip_level=None):
+    def iter_trailing_whitespace_reports(self, strip_level=None):
+        """Iterate over the trailing white space reports for the files
+        in this patch that have offending lines.  Lazy: callers that
+        only want to know whether any file offends can stop at the
+        first report.
+        """
         strip_level = self._adjusted_strip_level(strip_level)
-        reports = []
         for diff_plus in self.diff_pluses:
             bad_lines = diff_plus.report_trailing_whitespace()
             if bad_lines:
                 path = diff_plus.get_file_path(strip_level=strip_level)
-                reports.append(_FILE_AND_TWS_LINES(path, bad_lines))
-        return reports
+                yield _FILE_AND_TWS_LINES(path, bad_lines)
+
+    def report_trailing_whitespace(self, strip_level=None):
+        if len(self.diff_pluses) > _PARALLEL_DIFF_PLUS_THRESHOLD:
+            strip_level = self._adjusted_strip_level(strip_level)
+            reports = []
+            all_bad_lines = _map_over_diff_pluses(lambda dp: dp.report_trailing_whitespace(), self.diff_pluses)
+            for diff_plus, bad_lines in zip(self.diff_pluses, all_bad_lines):
+                if bad_lines:
+                    path = diff_plus.get_file_path(strip_level=strip_level)
+                    reports.append(_FILE_AND_TWS_LINES(path, bad_lines))
+            return reports
+        return list(self.iter_trailing_whitespace_reports(strip_level=strip_level))
 
     def get_hash_digest(self):
-        h = hashlib.sha1()
-        h.update(str(self).encode())
-        return h.digest()
+        # cache the digest: it is typically polled repeatedly between
+        # changes and all our own mutators null the cache
+        if self._hash_cache is None:
+            if self._str_cache is not None:
+                # the rendered text is already in hand so take
+                # hashlib's one shot constructor path
+                self._hash_cache = hashlib.sha1(self._str_cache.encode()).digest()
+            else:
+                # feed the hash line by line rather than materializing
+                # the whole patch text just to digest it
+                h = hashlib.sha1()
+                for line in self.iter_lines():
+                    h.update(line.encode())
+                self._hash_cache = h.digest()
+        return self._hash_cache
@@ -21,6 +21,7 @@ __all__ = []
 __author__ = "Peter Williams <pwil3058@gmail.com>"
 
 import collections
+import functools
 import os
 import sys
 
@@ -101,34 +102,51 @@ def file_data_consistent_with_strip_one(pair):
 class TextLines:
     """Manage a list of text lines
     """
+    # parsers create one of these per stored component so keep them
+    # free of a per instance dict
+    __slots__ = ("__lines", "__text")
+
     def __init__(self, contents=None):
+        # when given a single string keep it whole and defer splitting
+        # into lines until somebody actually needs the line view: this
+        # collapses N line allocations (and the join in __str__) to one
+        # blob for the common parse/stringify round trip
         if contents is None:
             self.__lines = list()
+            self.__text = None
         elif isinstance(contents, str):
-            self.__lines = contents.splitlines(True)
+            self.__lines = None
+            self.__text = contents
         else:
             self.__lines = list(contents)
+            self.__text = None
 
     @property
     def lines(self):
+        if self.__lines is None:
+            self.__lines = self.__text.splitlines(True)
+            self.__text = None
         return self.__lines
 
     def __str__(self):
+        if self.__text is not None:
+            return self.__text
         return "".join(self.__lines)
 
     def __iter__(self):
-        return (line for line in self.__lines)
+        return (line for line in self.lines)
 
     def append(self, data):
         """Append text or lines of text to managed lines
         """
         if isinstance(data, str):
-            self.__lines += data.splitlines(True)
+            self.lines.extend(data.splitlines(True))
         else:
-            self.__lines += list(data)
+            self.lines.extend(data)
 
 
 class FilePathPlus:
+    __slots__ = ("path", "status", "expath")
     ADDED = "+"
     EXTANT = " "
     DELETED = "-"
@@ -160,13 +178,18 @@ class FilePathPlus:
         return FilePathPlus(path=path, status=status, expath=None)
 
 
+@functools.lru_cache(maxsize=8)
 def gen_strip_level_function(level):
     """Return a function for stripping the specified levels off a file path"""
     def strip_n(path, level):
-        try:
-            return path.split(os.sep, level)[level]
-        except IndexError:
-            raise TooManyStripLevels(_("Strip level too large"), path, level)
+        # walk the separators with str.find: split() builds a whole
+        # list just so its last element can be taken
+        pos = 0
+        for _unused in range(level):
+            pos = path.find(os.sep, pos) + 1
+            if not pos:
+                raise TooManyStripLevels(_("Strip level too large"), path, level)
+        return path[pos:]
     level = int(level)
     if level == 0:
         return lambda path: path
@@ -18,6 +18,8 @@
 """
 
 import collections
+import concurrent.futures
+import itertools
 import os
 import re
 import sys
@@ -52,7 +54,12 @@ EITHER_TS_RE_STR = "(%s|%s)" % (_TIMESTAMP_RE_STR, _ALT_TIMESTAMP_RE_STR)
 def trim_trailing_ws(line):
     """Return the given line with any trailing white space removed
     """
-    return re.sub(r"[ \t]+$", "", line)
+    # str.rstrip() is a single C level scan of the line's tail which is
+    # several times faster than running the regex engine per line
+    body = line.rstrip("\r\n")
+    if len(body) != len(line):
+        return body.rstrip(" \t") + line[len(body):]
+    return line.rstrip(" \t")
 
 
 def to_text_lines(content):
@@ -129,11 +136,15 @@ class TextDiffParser:
     """
     BEFORE_FILE_CRE = None
     AFTER_FILE_CRE = None
+    # subclasses bind the compiled regexes' match methods to these so
+    # that header matching skips an attribute chain per call
+    _BEFORE_FILE_MATCH = None
+    _AFTER_FILE_MATCH = None
     diff_format = None
 
     @staticmethod
-    def _get_file_data_at(cre, lines, index):
-        match = cre.match(lines[index])
+    def _get_file_data_at(match_line, lines, index):
+        match = match_line(lines[index])
         if not match:
             return (None, index)
         file_path = match.group(2) if match.group(2) else match.group(3)
@@ -143,13 +154,13 @@ class TextDiffParser:
     def get_before_file_data_at(cls, lines, index):
         """Get data for the "before" file the diff applies to
         """
-        return cls._get_file_data_at(cls.BEFORE_FILE_CRE, lines, index)
+        return cls._get_file_data_at(cls._BEFORE_FILE_MATCH, lines, index)
 
     @classmethod
     def get_after_file_data_at(cls, lines, index):
         """Get data for the "after" file the diff applies to
         """
-        return cls._get_file_data_at(cls.AFTER_FILE_CRE, lines, index)
+        return cls._get_file_data_at(cls._AFTER_FILE_MATCH, lines, index)
 
     @staticmethod
     def get_hunk_at(lines, index):
@@ -166,7 +177,6 @@ class TextDiffParser:
         """
         if len(lines) - start_index < 2:
             return (None, start_index)
-        hunks = list()
         index = start_index
         before_file_data, index = cls.get_before_file_data_at(lines, index)
         if not before_file_data:
@@ -177,6 +187,9 @@ class TextDiffParser:
                 raise ParseError(_("Missing unified diff after file data."), index)
             else:
                 return (None, start_index)
+        # deferred to here so the (common) early returns above don't
+        # pay for an allocation they never use
+        hunks = list()
         while index < len(lines):
             hunk, index = cls.get_hunk_at(lines, index)
             if hunk is None:
@@ -235,18 +248,38 @@ class TextDiffHunk(collections.namedtuple("TextDiffHunk", ["lines", "before", "a
     def __iter__(self):
         return (line for line in self.lines)
 
-    def _process_tws(self, fix=False):
+    def _process_tws(self, fix=False, out=None):
         """If "fix" is True remove any trailing white space from
         changed lines and return a list of lines that were fixed
         otherwise return a list of changed lines that have tailing
-        white space
+        white space.  If "out" is provided append to it instead of
+        allocating a fresh list.
+        """
+        return out if out is not None else list()
+
+    def _get_diffstat_stats(self):
+        """Compute the "diffstat" statistics for this chunk
         """
-        return list() if fix else []
+        return diffstat.DiffStats()
 
     def get_diffstat_stats(self):
         """Return the "diffstat" statistics for this chunk
         """
-        return diffstat.DiffStats()
+        # display code asks for the stats repeatedly; trailing white
+        # space fixes don't alter the counts so the cached result
+        # never needs invalidating
+        try:
+            return self._diffstat_cache
+        except AttributeError:
+            stats = self._diffstat_cache = self._get_diffstat_stats()
+            return stats
+
+    def analyze(self, fix=False):
+        """Return this chunk's "diffstat" statistics along with the
+        list of changed lines that have (or, if "fix" is True, had)
+        trailing white space
+        """
+        return (self.get_diffstat_stats(), self._process_tws(fix=fix))
 
     def fix_trailing_whitespace(self):
         """Fix any lines that would introduce trailing white space when
@@ -304,6 +337,21 @@ class TextDiffHunk(collections.namedtuple("TextDiffHunk", ["lines", "before", "a
         post_context_len = abs(a_diff.first_inequality_fm_tail(before.lines, after.lines)) - 1
         return a_diff.AbstractHunk(before, after, pre_context_len, post_context_len)
 
+# per hunk work is independent so for diffs with a lot of hunks it is
+# worth farming it out to a thread pool
+_PARALLEL_HUNK_THRESHOLD = 64
+
+
+def _map_over_hunks(function, hunks):
+    """Apply "function" to each of "hunks" (in order) using a thread
+    pool when there are enough of them to cover the pool's overheads
+    """
+    if len(hunks) > _PARALLEL_HUNK_THRESHOLD:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            return list(executor.map(function, hunks))
+    return [function(hunk) for hunk in hunks]
+
+
 class TextDiff(collections.namedtuple("TextDiff", ["diff_format", "header", "hunks"])):
     """A class to encapsulate "text" diffs regardless of format.
     """
@@ -319,36 +367,64 @@ class TextDiff(collections.namedtuple("TextDiff", ["diff_format", "header", "hun
     def iter_lines(self):
         """Iterate over the lines in this diff
         """
-        for line in self.header:
-            yield line
+        yield from self.header
         for hunk in self.hunks:
-            for line in hunk:
-                yield line
+            yield from hunk
+
+    def analyze(self, fix=False):
+        """Return the "diffstat" statistics for this diff along with
+        the list of lines that have (or, if "fix" is True, had)
+        trailing white space.  Does both jobs in a single traversal of
+        the hunks' lines which callers wanting both should prefer.
+        """
+        stats = diffstat.DiffStats()
+        bad_lines = list()
+        for hunk_stats, hunk_bad_lines in _map_over_hunks(lambda hunk: hunk.analyze(fix), self.hunks):
+            stats += hunk_stats
+            bad_lines += hunk_bad_lines
+        return (stats, bad_lines)
+
+    def _collect_tws(self, fix):
+        """Gather the hunks' trailing white space reports into one list,
+        sharing that list across the hunks when running sequentially
+        """
+        bad_lines = list()
+        if len(self.hunks) > _PARALLEL_HUNK_THRESHOLD:
+            for hunk_bad_lines in _map_over_hunks(lambda hunk: hunk._process_tws(fix=fix), self.hunks):
+                bad_lines += hunk_bad_lines
+        else:
+            for hunk in self.hunks:
+                hunk._process_tws(fix=fix, out=bad_lines)
+        return bad_lines
 
     def fix_trailing_whitespace(self):
         """Fix any lines that would introduce trailing white space when
         the diff is applied and return a list of the changed lines
         """
-        bad_lines = list()
-        for hunk in self.hunks:
-            bad_lines += hunk.fix_trailing_whitespace()
-        return bad_lines
+        return self._collect_tws(fix=True)
 
     def report_trailing_whitespace(self):
         """Return a list of lines that will introduce tailing white
         space when the diff is applied
         """
-        bad_lines = list()
-        for hunk in self.hunks:
-            bad_lines += hunk.report_trailing_whitespace()
-        return bad_lines
+        return self._collect_tws(fix=False)
+
+    def iter_report_trailing_whitespace(self):
+        """Iterate over the lines that will introduce tailing white
+        space when the diff is applied, scanning one hunk at a time.
+        Callers that only iterate the report should prefer this to
+        "report_trailing_whitespace" as it avoids building the full
+        list up front.
+        """
+        return itertools.chain.from_iterable(
+            hunk._process_tws(fix=False) for hunk in self.hunks)
 
     def get_diffstat_stats(self):
         """Return the "diffstat" statistics for this diff
         """
         stats = diffstat.DiffStats()
-        for hunk in self.hunks:
-            stats += hunk.get_diffstat_stats()
+        for hunk_stats in _map_over_hunks(lambda hunk: hunk.get_diffstat_stats(), self.hunks):
+            stats += hunk_stats
         return stats
 
     def get_file_path(self, strip_level=0):
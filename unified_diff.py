@@ -16,11 +16,12 @@
 
 """Create, parse and apply "unified" format diffs"""
 
-import collections
 import difflib
 import os
 import re
 
+from dataclasses import dataclass
+
 from . import t_diff
 from . import diffstat
 from . import pd_utils
@@ -30,45 +31,109 @@ __author__ = "Peter Williams <pwil3058@gmail.com>"
 
 DEBUG = False
 
-_CHUNK = collections.namedtuple("_CHUNK", ["start", "length"])
+@dataclass(frozen=True, slots=True)
+class _CHUNK:
+    start: int
+    length: int
 
 
 class UnifiedDiffHunk(t_diff.TextDiffHunk):
     """Class to encapsulate a single unified diff hunk
     """
-    def _process_tws(self, fix=False):
+    def _process_tws(self, fix=False, out=None):
         """If "fix" is True remove any trailing white space from
         changed lines and return a list of lines that were fixed
         otherwise return a list of changed lines that have tailing
-        white space
+        white space.  If "out" is provided append to it instead of
+        allocating a fresh list.
         """
-        bad_lines = list()
+        bad_lines = out if out is not None else list()
+        after_count = 0
+        lines = self.lines
+        start = self.after.start
+        for index, line in enumerate(lines):
+            first_char = line[:1]
+            if first_char == "+":
+                after_count += 1
+                repl_line = t_diff.trim_trailing_ws(line)
+                if len(repl_line) != len(line):
+                    bad_lines.append(str(start + after_count - 1))
+                    if fix:
+                        lines[index] = repl_line
+            elif first_char == " ":
+                after_count += 1
+        return bad_lines
+
+    def _process_tws_debug(self, fix=False, out=None):
+        """Variant of "_process_tws" that validates the hunk's lines
+        as it goes.  Installed in its place when DEBUG is set.
+        """
+        bad_lines = out if out is not None else list()
         after_count = 0
-        for index in range(len(self.lines)):
-            if self.lines[index].startswith("+"):
+        lines = self.lines
+        start = self.after.start
+        for index, line in enumerate(lines):
+            first_char = line[:1]
+            if first_char == "+":
                 after_count += 1
-                repl_line = t_diff.trim_trailing_ws(self.lines[index])
-                if len(repl_line) != len(self.lines[index]):
-                    bad_lines.append(str(self.after.start + after_count - 1))
+                repl_line = t_diff.trim_trailing_ws(line)
+                if len(repl_line) != len(line):
+                    bad_lines.append(str(start + after_count - 1))
                     if fix:
-                        self.lines[index] = repl_line
-            elif self.lines[index].startswith(" "):
+                        lines[index] = repl_line
+            elif first_char == " ":
                 after_count += 1
-            elif DEBUG and not self.lines[index].startswith("-"):
+            elif first_char != "-":
                 raise t_diff.Bug("Unexpected end of unified diff hunk.")
         return bad_lines
 
-    def get_diffstat_stats(self):
-        """Return the "diffstat" statistics for this chunk
+    def analyze(self, fix=False):
+        """Return this chunk's "diffstat" statistics along with the
+        list of changed lines that have (or, if "fix" is True, had)
+        trailing white space in a single pass over the lines
         """
         stats = diffstat.DiffStats()
-        for index in range(len(self.lines)):
-            if self.lines[index].startswith("-"):
-                stats.incr("deleted")
-            elif self.lines[index].startswith("+"):
+        bad_lines = list()
+        after_count = 0
+        lines = self.lines
+        start = self.after.start
+        for index, line in enumerate(lines):
+            first_char = line[:1]
+            if first_char == "+":
                 stats.incr("inserted")
-            elif DEBUG and not self.lines[index].startswith(" "):
-                raise t_diff.Bug("Unexpected end of unified diff hunk.")
+                after_count += 1
+                repl_line = t_diff.trim_trailing_ws(line)
+                if len(repl_line) != len(line):
+                    bad_lines.append(str(start + after_count - 1))
+                    if fix:
+                        lines[index] = repl_line
+            elif first_char == "-":
+                stats.incr("deleted")
+            elif first_char == " ":
+                after_count += 1
+        return (stats, bad_lines)
+
+    def _get_diffstat_stats(self):
+        """Compute the "diffstat" statistics for this chunk
+        """
+        # only the first character of each line matters so join them
+        # into one compact string and let str.count() do the scanning
+        firsts = "".join(line[:1] for line in self.lines[1:])
+        stats = diffstat.DiffStats()
+        stats.incr("deleted", firsts.count("-"))
+        stats.incr("inserted", firsts.count("+"))
+        return stats
+
+    def _get_diffstat_stats_debug(self):
+        """Variant of "_get_diffstat_stats" that validates the hunk's
+        lines as it goes.  Installed in its place when DEBUG is set.
+        """
+        firsts = "".join(line[:1] for line in self.lines[1:])
+        if firsts.strip("+- \\"):
+            raise t_diff.Bug("Unexpected end of unified diff hunk.")
+        stats = diffstat.DiffStats()
+        stats.incr("deleted", firsts.count("-"))
+        stats.incr("inserted", firsts.count("+"))
         return stats
 
     def iter_before_lines(self):
@@ -82,42 +147,69 @@ class UnifiedDiffHunk(t_diff.TextDiffHunk):
         return (line for line in self._iter_lines(self.lines, "-"))
 
 
+if DEBUG:
+    # install the validating variants of the hot loop methods so that
+    # the fast versions carry no per line DEBUG tests at all
+    UnifiedDiffHunk._process_tws = UnifiedDiffHunk._process_tws_debug
+    UnifiedDiffHunk._get_diffstat_stats = UnifiedDiffHunk._get_diffstat_stats_debug
+
+
 class UnifiedDiffParser(t_diff.TextDiffParser):
     """Class to parse "unified" diffs
     """
     diff_format = "unified"
-    BEFORE_FILE_CRE = re.compile(r"^--- ({0})(\s+{1})?(.*)$".format(pd_utils.PATH_RE_STR, t_diff.EITHER_TS_RE_STR))
-    AFTER_FILE_CRE = re.compile(r"^\+\+\+ ({0})(\s+{1})?(.*)$".format(pd_utils.PATH_RE_STR, t_diff.EITHER_TS_RE_STR))
-    HUNK_DATA_CRE = re.compile(r"^@@\s+-(\d+)(,(\d+))?\s+\+(\d+)(,(\d+))?\s+@@\s*(.*)$")
+    BEFORE_FILE_CRE = re.compile(r"--- ({0})(\s+{1})?(.*)$".format(pd_utils.PATH_RE_STR, t_diff.EITHER_TS_RE_STR))
+    AFTER_FILE_CRE = re.compile(r"\+\+\+ ({0})(\s+{1})?(.*)$".format(pd_utils.PATH_RE_STR, t_diff.EITHER_TS_RE_STR))
+    _BEFORE_FILE_MATCH = BEFORE_FILE_CRE.match
+    _AFTER_FILE_MATCH = AFTER_FILE_CRE.match
+    HUNK_DATA_CRE = re.compile(r"@@\s+-(\d+)(,(\d+))?\s+\+(\d+)(,(\d+))?\s+@@\s*(.*)$")
+    # the fixed shape that "git" (and GNU diff) emit: both lengths present
+    # and single spaces so try it before the general (backtracking) form
+    HUNK_DATA_FAST_CRE = re.compile(r"@@ -(\d+),(\d+) \+(\d+),(\d+) @@")
+    _HUNK_DATA_MATCH = HUNK_DATA_CRE.match
+    _HUNK_DATA_FAST_MATCH = HUNK_DATA_FAST_CRE.match
 
     @staticmethod
     def get_hunk_at(lines, index):
-        match = UnifiedDiffParser.HUNK_DATA_CRE.match(lines[index])
-        if not match:
+        # cheap one-comparison reject before starting the regex engine
+        if not lines[index].startswith("@@"):
             return (None, index)
+        match = UnifiedDiffParser._HUNK_DATA_FAST_MATCH(lines[index])
+        if match:
+            before_start = int(match.group(1))
+            before_length = int(match.group(2))
+            after_start = int(match.group(3))
+            after_length = int(match.group(4))
+        else:
+            match = UnifiedDiffParser._HUNK_DATA_MATCH(lines[index])
+            if not match:
+                return (None, index)
+            before_start = int(match.group(1))
+            before_length = int(match.group(3)) if match.group(3) is not None else 1
+            after_start = int(match.group(4))
+            after_length = int(match.group(6)) if match.group(6) is not None else 1
         start_index = index
-        before_length = int(match.group(3)) if match.group(3) is not None else 1
-        after_length = int(match.group(6)) if match.group(6) is not None else 1
         index += 1
         before_count = after_count = 0
         try:
             while before_count < before_length or after_count < after_length:
-                if lines[index].startswith("-"):
+                first_char = lines[index][:1]
+                if first_char == "-":
                     before_count += 1
-                elif lines[index].startswith("+"):
+                elif first_char == "+":
                     after_count += 1
-                elif lines[index].startswith(" "):
+                elif first_char == " ":
                     before_count += 1
                     after_count += 1
-                elif not lines[index].startswith("\\"):
+                elif first_char != "\\":
                     raise t_diff.ParseError(_("Unexpected end of unified diff hunk."), index)
                 index += 1
             if index < len(lines) and lines[index].startswith("\\"):
                 index += 1
         except IndexError:
             raise t_diff.ParseError(_("Unexpected end of patch text."))
-        before_chunk = _CHUNK(int(match.group(1)), before_length)
-        after_chunk = _CHUNK(int(match.group(4)), after_length)
+        before_chunk = _CHUNK(before_start, before_length)
+        after_chunk = _CHUNK(after_start, after_length)
         return (UnifiedDiffHunk(lines[start_index:index], before_chunk, after_chunk), index)
 
 
@@ -154,4 +246,21 @@ def generate_diff(before, after, num_context_lines=3):
     before and after data.
     """
     diff_lines = generate_diff_lines(before, after, num_context_lines)
-    return parse_diff_lines(diff_lines) if diff_lines else None
+    if not diff_lines:
+        return None
+    # the lines are our own (canonical) output so build the diff
+    # directly instead of re-parsing what we just emitted
+    header = t_diff.TextDiffHeader(diff_lines[:2],
+                                   t_diff.PathAndTimestamp(before.label, before.timestamp),
+                                   t_diff.PathAndTimestamp(after.label, after.timestamp))
+    hunk_starts = [index for index in range(2, len(diff_lines)) if diff_lines[index].startswith("@@")]
+    hunk_starts.append(len(diff_lines))
+    hunks = []
+    for start, end in zip(hunk_starts[:-1], hunk_starts[1:]):
+        match = UnifiedDiffParser.HUNK_DATA_CRE.match(diff_lines[start])
+        before_length = int(match.group(3)) if match.group(3) is not None else 1
+        after_length = int(match.group(6)) if match.group(6) is not None else 1
+        before_chunk = _CHUNK(int(match.group(1)), before_length)
+        after_chunk = _CHUNK(int(match.group(4)), after_length)
+        hunks.append(UnifiedDiffHunk(diff_lines[start:end], before_chunk, after_chunk))
+    return t_diff.TextDiff(UnifiedDiffParser.diff_format, header, hunks)